@@ -1,16 +1,24 @@
-import json
 import os
-from typing import Dict, Any, List
+from operator import itemgetter
+from typing import Dict, Any, Iterable, Iterator, List
+
+import ijson
+import orjson
 
 ROR_POLITO = "https://ror.org/00bgk9508"
+# get_data_from_OpenAlex.py already filters the works on the Polito ROR, so
+# every work is expected to have a Polito author. When True, that invariant is
+# trusted and the per-work Polito check is skipped.
+TRUST_UPSTREAM_FILTER = True
 
 
-def load_polito_works(path: str) -> List[Dict[str, Any]]:
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+def iter_polito_works(path: str) -> Iterator[Dict[str, Any]]:
+    # Stream the works one at a time instead of loading the whole list
+    with open(path, "rb") as f:
+        yield from ijson.items(f, "item", use_float=True)
 
 
-def build_all_datasets(works: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+def build_all_datasets(works: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """
     Build a list of all datasets including those with only Politecnico di Torino authors.
     Returns a list of datasets:
@@ -23,44 +31,34 @@ def build_all_datasets(works: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         ...
     ]
     """
-    all_datasets = []
-    seen_ids = set()
-
-    for work in works:
-        authorships = work.get("authorships") or []
-
-        # Determine if the work has at least one Polito author
-        has_polito = False
-        for auth in authorships:
-            for inst in auth.get("institutions") or []:
-                if inst.get("ror") == ROR_POLITO:
-                    has_polito = True
-                    break
-            if has_polito:
-                break
-
-        if not has_polito:
-            # Skip works without Polito authors
-            continue
-
-        work_id = work.get("id")
-        if not work_id or work_id in seen_ids:
-            continue
-
-        seen_ids.add(work_id)
-
-        title = work.get("display_name") or work.get("title")
-        year = work.get("publication_year")
-
-        all_datasets.append({
-            "dataset_id": work_id,
-            "title": title,
-            "year": year,
-        })
+    ror_polito = ROR_POLITO
+    check_polito = not TRUST_UPSTREAM_FILTER
+
+    # Keyed by work id, which also drops duplicated works.
+    # Year and title are normalized here so that the datasets can be sorted
+    # with a plain itemgetter key.
+    items = {
+        work["id"]: (
+            work.get("publication_year") or 0,
+            work.get("display_name") or work.get("title") or "",
+        )
+        for work in works
+        if work.get("id")
+        # Skip works without Polito authors
+        and (not check_polito or any(
+            inst.get("ror") == ror_polito
+            for auth in work.get("authorships") or []
+            for inst in auth.get("institutions") or []
+        ))
+    }
 
     # Sort by year (descending), then by title
-    all_datasets.sort(
-        key=lambda d: (d.get("year") or 0, d.get("title") or ""),
+    all_datasets = sorted(
+        (
+            {"dataset_id": work_id, "title": title, "year": year}
+            for work_id, (year, title) in items.items()
+        ),
+        key=itemgetter("year", "title"),
         reverse=True,
     )
 
@@ -74,11 +72,10 @@ def main() -> None:
     if not os.path.exists(src):
         raise SystemExit(f"{src} not found – run get_data_from_OpenAlex.py first.")
 
-    works = load_polito_works(src)
-    all_datasets = build_all_datasets(works)
+    all_datasets = build_all_datasets(iter_polito_works(src))
 
-    with open(out, "w", encoding="utf-8") as f:
-        json.dump(all_datasets, f, ensure_ascii=False, indent=2)
+    with open(out, "wb") as f:
+        f.write(orjson.dumps(all_datasets, option=orjson.OPT_INDENT_2))
 
     print(f"Wrote {len(all_datasets)} datasets to {out}")
 
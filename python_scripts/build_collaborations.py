@@ -1,24 +1,43 @@
 import csv
-import json
 import os
+import re
+import sqlite3
+import sys
 import time
 from collections import defaultdict
-from typing import Dict, Any, List
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+from typing import Dict, Any, Iterable, Iterator, List, Set
 
+import ijson
+import orjson
 import requests
 
 ROR_POLITO = "https://ror.org/00bgk9508"
-OPENALEX_INSTITUTION_API = "https://api.openalex.org/institutions/{}"
-
-
-def load_polito_works(path: str) -> List[Dict[str, Any]]:
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+# get_data_from_OpenAlex.py already filters the works on the Polito ROR, so
+# every work is expected to have a Polito author. When True, that invariant is
+# trusted and the per-work Polito check is skipped.
+TRUST_UPSTREAM_FILTER = True
+OPENALEX_INSTITUTIONS_API = "https://api.openalex.org/institutions"
+OPENALEX_BATCH_SIZE = 100
+OPENALEX_PAGE_SIZE = 200
+OPENALEX_MAX_WORKERS = 10
+# Optional contact email, sent as `mailto` to use the OpenAlex polite pool
+OPENALEX_EMAIL = os.environ.get("OPENALEX_EMAIL", "")
+# Institution country codes are kept on disk across runs for this long
+INST_CACHE_MAX_AGE = 30 * 86400  # seconds
+
+
+def iter_polito_works(path: str) -> Iterator[Dict[str, Any]]:
+    # Stream the works one at a time instead of loading the whole list
+    with open(path, "rb") as f:
+        yield from ijson.items(f, "item", use_float=True)
 
 
 def load_country_codes(path: str) -> Dict[str, Dict[str, Any]]:
     """
     Load country codes from CSV and create a mapping from country codes to country info.
+    The country info has the shape of the "country" field of collaborations.json.
     Returns a dictionary like:
     {
         "IT": {
@@ -51,10 +70,163 @@ def load_country_codes(path: str) -> Dict[str, Dict[str, Any]]:
     return country_map
 
 
+def institution_short_id(inst_id: str) -> str:
+    # Example id: "https://openalex.org/I55143463" -> "I55143463"
+    return inst_id.rsplit("/", 1)[-1]
+
+
+def collect_missing_institution_ids(path: str) -> Set[str]:
+    """
+    Collect the short ids of all institutions whose country_code is not
+    already present inline in the work payload.
+    Streams only the institution objects of the works file, without
+    building the rest of each work.
+    """
+    missing = set()
+    ror_polito = ROR_POLITO
+    with open(path, "rb") as f:
+        for inst in ijson.items(f, "item.authorships.item.institutions.item"):
+            if inst.get("country_code") or inst.get("ror") == ror_polito:
+                continue
+            inst_id = inst.get("id")
+            if inst_id:
+                short_id = institution_short_id(inst_id)
+                # Skip placeholders such as "I-1", which are not valid
+                # OpenAlex ids and would break the whole batch filter
+                if re.fullmatch(r"I\d+", short_id):
+                    missing.add(short_id)
+    return missing
+
+
+def fetch_institutions_batch(session: requests.Session, chunk: List[str]) -> Dict[str, str]:
+    """
+    Fetch the country_code of up to OPENALEX_BATCH_SIZE institutions with a
+    single filter + select query (cursor-paginated).
+    Returns a mapping short_id -> country_code ("" for institutions unknown
+    to OpenAlex), or an empty mapping if the batch could not be fetched.
+    If OpenAlex rejects the batch, it is split in halves and retried, so a
+    single bad id only loses its own lookup.
+    """
+    params = {
+        "filter": "openalex_id:" + "|".join(chunk),
+        "select": "id,country_code",
+        "per-page": OPENALEX_PAGE_SIZE,
+        "cursor": "*",
+    }
+    if OPENALEX_EMAIL:
+        # Join the OpenAlex polite pool
+        params["mailto"] = OPENALEX_EMAIL
+
+    batch: Dict[str, str] = {}
+    try:
+        while params["cursor"]:
+            resp = session.get(OPENALEX_INSTITUTIONS_API, params=params, timeout=30)
+            if resp.status_code != 200:
+                if len(chunk) > 1:
+                    middle = len(chunk) // 2
+                    return {
+                        **fetch_institutions_batch(session, chunk[:middle]),
+                        **fetch_institutions_batch(session, chunk[middle:]),
+                    }
+                print(f"Warning: Failed to fetch institution {chunk[0]} (status code: {resp.status_code})")
+                return {}
+            data = resp.json()
+            results = data.get("results") or []
+            for inst in results:
+                batch[institution_short_id(inst["id"])] = inst.get("country_code") or ""
+
+            # OpenAlex returns a next_cursor even with the last page, so stop
+            # on a short page or once all the matching institutions are read,
+            # instead of requesting the empty page that follows
+            meta = data.get("meta") or {}
+            count = meta.get("count")
+            if len(results) < OPENALEX_PAGE_SIZE or (count is not None and len(batch) >= count):
+                break
+            params["cursor"] = meta.get("next_cursor")
+    except Exception:
+        # In case of network errors or unexpected payloads, leave the
+        # institutions of this batch uncached and let the caller skip them.
+        return {}
+
+    # Institutions unknown to OpenAlex: remember them as without country
+    for short_id in chunk:
+        batch.setdefault(short_id, "")
+    return batch
+
+
+def load_institution_cache(path: str, max_age: int = INST_CACHE_MAX_AGE) -> Dict[str, str]:
+    """
+    Load the institution country codes fetched by previous runs from the
+    SQLite cache at `path`, ignoring entries older than `max_age` seconds.
+    Returns a mapping short_id -> country_code.
+    """
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS insts(id TEXT PRIMARY KEY, cc TEXT, fetched_at INTEGER)"
+        )
+        rows = conn.execute(
+            "SELECT id, cc FROM insts WHERE fetched_at > ?",
+            (int(time.time()) - max_age,),
+        )
+        cache = dict(rows)
+    conn.close()
+    return cache
+
+
+def save_institution_cache(path: str, entries: Dict[str, str]) -> None:
+    """
+    Store freshly fetched institution country codes in the SQLite cache at
+    `path`, in a single transaction.
+    Institutions without a country code (e.g. ids missing from the OpenAlex
+    results after a merge) are not persisted, so they are retried next run.
+    """
+    entries = {short_id: cc for short_id, cc in entries.items() if cc}
+    if not entries:
+        return
+
+    fetched_at = int(time.time())
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS insts(id TEXT PRIMARY KEY, cc TEXT, fetched_at INTEGER)"
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO insts(id, cc, fetched_at) VALUES (?, ?, ?)",
+            [(short_id, cc, fetched_at) for short_id, cc in entries.items()],
+        )
+    conn.close()
+
+
+def prefetch_institution_country_codes(short_ids: Set[str], cache: Dict[str, str]) -> Dict[str, str]:
+    """
+    Fill the cache with the country_code of the given institutions, querying
+    the OpenAlex institutions endpoint in batches of OPENALEX_BATCH_SIZE ids
+    instead of one request per institution. Batches are fetched concurrently
+    over a shared session, since the cost is network latency, not CPU.
+    Institutions already in the cache are not fetched again.
+    Returns the newly fetched entries.
+    """
+    pending = sorted(short_ids - cache.keys())
+    chunks = [
+        pending[start:start + OPENALEX_BATCH_SIZE]
+        for start in range(0, len(pending), OPENALEX_BATCH_SIZE)
+    ]
+    fetched: Dict[str, str] = {}
+    if not chunks:
+        return fetched
+
+    with requests.Session() as session:
+        with ThreadPoolExecutor(max_workers=OPENALEX_MAX_WORKERS) as executor:
+            for batch in executor.map(lambda chunk: fetch_institutions_batch(session, chunk), chunks):
+                fetched.update(batch)
+
+    cache.update(fetched)
+    return fetched
+
+
 def get_institution_country_code(inst: Dict[str, Any], cache: Dict[str, str]) -> str:
     """
     Try to get the country_code from the institution object itself,
-    otherwise fall back to querying the OpenAlex institution endpoint.
+    otherwise fall back to the cache filled by prefetch_institution_country_codes.
     """
     # Directly present in the work payload (most common case)
     if "country_code" in inst and inst["country_code"]:
@@ -64,31 +236,12 @@ def get_institution_country_code(inst: Dict[str, Any], cache: Dict[str, str]) ->
     if not inst_id:
         return ""
 
-    # Example id: "https://openalex.org/I55143463"
-    short_id = inst_id.rsplit("/", 1)[-1]
-
-    if short_id in cache:
-        return cache[short_id]
-
-    url = OPENALEX_INSTITUTION_API.format(short_id)
-    try:
-        resp = requests.get(url, timeout=10)
-        if resp.status_code == 200:
-            data = resp.json()
-            cc = data.get("country_code") or ""
-            cache[short_id] = cc
-            # Be gentle with the API
-            time.sleep(0.1)
-            return cc
-    except Exception:
-        # In case of network errors or unexpected payloads,
-        # just return empty and let the caller skip it.
-        return ""
-
-    return ""
+    return cache.get(institution_short_id(inst_id), "")
 
 
-def build_collaborations(works: List[Dict[str, Any]]) -> Dict[str, Any]:
+def build_collaborations(
+    works: Iterable[Dict[str, Any]], inst_country_cache: Dict[str, str]
+) -> Dict[str, Any]:
     """
     Build a dictionary keyed by country_code:
     {
@@ -106,41 +259,50 @@ def build_collaborations(works: List[Dict[str, Any]]) -> Dict[str, Any]:
       },
       ...
     }
+    Institutions without an inline country_code are resolved through
+    inst_country_cache (see prefetch_institution_country_codes).
     """
-    inst_country_cache: Dict[str, str] = {}
 
     by_country: Dict[str, Dict[str, Any]] = {}
+    # Local bindings for the hot loops below
+    intern = sys.intern
+    ror_polito = ROR_POLITO
+    check_polito = not TRUST_UPSTREAM_FILTER
 
     for work in works:
-        authorships = work.get("authorships") or []
-
-        # Determine if the work has at least one Polito author
-        has_polito = False
-        for auth in authorships:
-            for inst in auth.get("institutions") or []:
-                if inst.get("ror") == ROR_POLITO:
-                    has_polito = True
-                    break
-            if has_polito:
-                break
-
-        if not has_polito:
-            # According to the data collection process this should be rare,
-            # but we enforce it explicitly.
-            continue
-
-        # Collect external institutions (non-Polito)
-        external_pairs = []  # (institution, country_code)
-        for auth in authorships:
-            for inst in auth.get("institutions") or []:
-                if inst.get("ror") == ROR_POLITO:
-                    continue
-
-                country_code = get_institution_country_code(inst, inst_country_cache)
-                if not country_code:
-                    continue
-
-                external_pairs.append((inst, country_code))
+        if check_polito:
+            # Single pass over the authorships: detect Polito and buffer the
+            # external (non-Polito) institutions at the same time
+            has_polito = False
+            external_insts = []
+            for auth in work.get("authorships") or []:
+                for inst in auth.get("institutions") or []:
+                    if inst.get("ror") == ror_polito:
+                        has_polito = True
+                    else:
+                        external_insts.append(inst)
+
+            if not has_polito:
+                # According to the data collection process this should not
+                # happen, but it is enforced explicitly.
+                continue
+        else:
+            # Every work has a Polito author: only exclude Polito itself
+            external_insts = [
+                inst
+                for auth in work.get("authorships") or []
+                for inst in auth.get("institutions") or []
+                if inst.get("ror") != ror_polito
+            ]
+
+        # Resolve the country of the external institutions, keeping each
+        # (institution, country) only once per work. Institutions without an
+        # id share the None id, so the country is part of the key.
+        external_pairs: Dict[Any, Any] = {}  # (inst_id, country_code) -> (institution, country_code)
+        for inst in external_insts:
+            country_code = get_institution_country_code(inst, inst_country_cache)
+            if country_code:
+                external_pairs.setdefault((inst.get("id"), country_code), (inst, country_code))
 
         # Skip works that only have Polito authors
         if not external_pairs:
@@ -149,26 +311,24 @@ def build_collaborations(works: List[Dict[str, Any]]) -> Dict[str, Any]:
         # Add this work for each external institution's country
         work_id = work.get("id")
         title = work.get("display_name") or work.get("title")
-        year = work.get("publication_year")
-
-        # Avoid adding the same (work, institution) twice per country
-        seen_for_work_country = set()
-
-        for inst, cc in external_pairs:
-            key = (work_id, inst.get("id"), cc)
-            if key in seen_for_work_country:
-                continue
-            seen_for_work_country.add(key)
-
-            if cc not in by_country:
-                by_country[cc] = {
+        # Normalized here so that the collaborations can be sorted with a
+        # plain itemgetter key
+        year = work.get("publication_year") or 0
+
+        for inst, cc in external_pairs.values():
+            # Country codes and partner names repeat across many works:
+            # intern them so that every occurrence shares one string object
+            cc = intern(cc)
+            country = by_country.get(cc)
+            if country is None:
+                country = by_country[cc] = {
                     "country_code": cc,
                     "collaborations": [],
                 }
 
-            by_country[cc]["collaborations"].append(
+            country["collaborations"].append(
                 {
-                    "partner": inst.get("display_name"),
+                    "partner": intern(inst.get("display_name") or ""),
                     "dataset_id": work_id,
                     "title": title,
                     "year": year,
@@ -178,52 +338,40 @@ def build_collaborations(works: List[Dict[str, Any]]) -> Dict[str, Any]:
     return by_country
 
 
-def main() -> None:
-    src = "data/polito_works.json"
-    country_codes_path = "data/all_country_codes.csv"
-    out = "data/collaborations.json"
-
-    if not os.path.exists(src):
-        raise SystemExit(f"{src} not found – run get_data_from_OpenAlex.py first.")
-
-    if not os.path.exists(country_codes_path):
-        raise SystemExit(f"{country_codes_path} not found.")
-
-    # Load country codes mapping
-    country_map = load_country_codes(country_codes_path)
-    print(f"Loaded {len(country_map)} country codes from {country_codes_path}")
-
-    works = load_polito_works(src)
-    data_by_country = build_collaborations(works)
-
-    # Convert to a list sorted by number of collaborations (descending)
-    # and enrich with country information from CSV
-    result = []
-    for cc, payload in data_by_country.items():
+def iter_country_entries(
+    data_by_country: Dict[str, Any], country_map: Dict[str, Dict[str, Any]]
+) -> Iterator[Dict[str, Any]]:
+    """
+    Yield one output entry per country, sorted by number of collaborations
+    (descending) and enriched with country information from CSV.
+    Entries are built one at a time, so the full result list never needs
+    to be held in memory.
+    """
+    payloads = sorted(
+        data_by_country.values(),
+        key=lambda p: len(p["collaborations"]),
+        reverse=True,
+    )
+    for payload in payloads:
+        cc = payload["country_code"]
         collabs = payload["collaborations"]
         
-        # Get country information from CSV
-        country_info = country_map.get(cc, {})
-        
         # Build the entry with country information
         entry = {
             "country_code": cc,
             "collaborations_count": len(collabs),
             "collaborations": sorted(
                 collabs,
-                key=lambda c: (c.get("year") or 0, c.get("partner") or ""),
+                key=itemgetter("year", "partner"),
                 reverse=True,
             ),
         }
         
-        # Add country information if available
+        # Add country information from CSV if available; the entries of
+        # country_map already have the output shape, so they are used as is
+        country_info = country_map.get(cc)
         if country_info:
-            entry["country"] = {
-                "name": country_info.get("name", ""),
-                "latitude": country_info.get("latitude", 0),
-                "longitude": country_info.get("longitude", 0),
-                "coords": country_info.get("coords", [0, 0]),  # [lat, lng] for Leaflet
-            }
+            entry["country"] = country_info
         else:
             # If country code not found in CSV, still include basic info
             entry["country"] = {
@@ -234,14 +382,60 @@ def main() -> None:
             }
             print(f"Warning: Country code '{cc}' not found in country codes CSV")
         
-        result.append(entry)
+        yield entry
+
+
+def write_json_array(path: str, items: Iterable[Any]) -> int:
+    """
+    Write the items as an indented JSON array, serializing one item at a
+    time instead of the whole list at once. The output matches
+    orjson.dumps(list(items), option=orjson.OPT_INDENT_2).
+    Returns the number of items written.
+    """
+    count = 0
+    with open(path, "wb") as f:
+        f.write(b"[")
+        for item in items:
+            f.write(b",\n  " if count else b"\n  ")
+            # Newlines only occur between tokens (they are escaped inside
+            # strings), so this nests the item one level deeper
+            f.write(orjson.dumps(item, option=orjson.OPT_INDENT_2).replace(b"\n", b"\n  "))
+            count += 1
+        f.write(b"\n]" if count else b"]")
+    return count
+
+
+def main() -> None:
+    src = "data/polito_works.json"
+    country_codes_path = "data/all_country_codes.csv"
+    out = "data/collaborations.json"
+    inst_cache_path = "data/inst_cache.sqlite"
+
+    if not os.path.exists(src):
+        raise SystemExit(f"{src} not found – run get_data_from_OpenAlex.py first.")
+
+    if not os.path.exists(country_codes_path):
+        raise SystemExit(f"{country_codes_path} not found.")
+
+    # Load country codes mapping
+    country_map = load_country_codes(country_codes_path)
+    print(f"Loaded {len(country_map)} country codes from {country_codes_path}")
+
+    # First streaming pass: resolve the institutions missing a country code,
+    # reusing the ones fetched by previous runs
+    inst_country_cache = load_institution_cache(inst_cache_path)
+    fetched = prefetch_institution_country_codes(
+        collect_missing_institution_ids(src), inst_country_cache
+    )
+    save_institution_cache(inst_cache_path, fetched)
+    print(f"Fetched {len(fetched)} institutions from OpenAlex, cached in {inst_cache_path}")
 
-    result.sort(key=lambda x: x["collaborations_count"], reverse=True)
+    # Second streaming pass: aggregate the collaborations
+    data_by_country = build_collaborations(iter_polito_works(src), inst_country_cache)
 
-    with open(out, "w", encoding="utf-8") as f:
-        json.dump(result, f, ensure_ascii=False, indent=2)
+    count = write_json_array(out, iter_country_entries(data_by_country, country_map))
 
-    print(f"Wrote {len(result)} countries to {out}")
+    print(f"Wrote {count} countries to {out}")
 
 
 if __name__ == "__main__":
@@ -1,55 +1,88 @@
 ROR_POLITO = 'https://ror.org/00bgk9508'
 work_type = 'dataset'
-import json
+import orjson
 import os
-import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import re
 import math
+import time
+
+per_page = 200 # Maximum page size allowed by OpenAlex
+email = os.environ.get('OPENALEX_EMAIL', '') # Optional contact email, sent as mailto to use the OpenAlex polite pool
 
-per_page = 25
+works_api = "https://api.openalex.org/works"
+params = {
+    'filter': f"type:{work_type},authorships.institutions.ror:{ROR_POLITO}",
+    'per-page': per_page,
+    'select': 'id,title,display_name,publication_year,authorships', # Only the fields used by build_*.py (select works on top-level fields only)
+    'cursor': '*', # Cursor pagination: start with '*', then follow meta.next_cursor
+}
+if email:
+    params['mailto'] = email
+
+# Reuse the same connection for all the pages
+# (requests already sends Accept-Encoding: gzip, deflate, so responses are compressed)
+session = requests.Session()
+# Retry transient failures (rate limiting, server errors) with exponential backoff,
+# since with cursor pagination a failed page cannot simply be skipped
+retries = Retry(total=5, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504], raise_on_status=False)
+session.mount('https://', HTTPAdapter(max_retries=retries))
 
 # First, get the first page to know the total count
 page_number = 1
-get_all_dataset_works_call = f"https://api.openalex.org/works?&filter=type:{work_type},authorships.institutions.ror:{ROR_POLITO}&page={page_number}&per_page={per_page}"       
 print(f"Fetching page {page_number}...")
-print(get_all_dataset_works_call)
-response = requests.get(get_all_dataset_works_call) # Get the response from the API for the given page number and per page limit    
+print(f"{works_api}?filter={params['filter']}") # Not response.url, which would include the mailto address
+response = session.get(works_api, params=params, timeout=30) # Get the response from the API for the first page
 
 if response.status_code == 200: # If the response is successful
     response.raise_for_status() # Raise an error if the response is not successful
     results_OA_dataset_works = response.json() # Get the JSON response from the API
     total_count = results_OA_dataset_works['meta']['count']
     print(f"Total Polito dataset works: {total_count}") # Print the total number of Polito dataset works
-    
+
     # Collect all results
     all_results = results_OA_dataset_works['results']
-    
+
     # Calculate total pages needed
     total_pages = math.ceil(total_count / per_page)
     print(f"Total pages to fetch: {total_pages}")
-    
-    # Fetch remaining pages
-    for page_number in range(2, total_pages + 1):
-        get_all_dataset_works_call = f"https://api.openalex.org/works?&filter=type:{work_type},authorships.institutions.ror:{ROR_POLITO}&page={page_number}&per_page={per_page}"
+
+    # Fetch remaining pages following the cursor. Each page needs the cursor
+    # returned by the previous one, so pages are fetched serially. Within the
+    # polite pool (email set) no delay is needed between requests
+    params['cursor'] = results_OA_dataset_works['meta'].get('next_cursor')
+    while params['cursor'] and len(all_results) < total_count:
+        page_number += 1
         print(f"Fetching page {page_number}/{total_pages}...")
-        response = requests.get(get_all_dataset_works_call)
-        
+        response = session.get(works_api, params=params, timeout=30)
+
         if response.status_code == 200:
             response.raise_for_status()
             page_results = response.json()
             all_results.extend(page_results['results'])
             print(f"  Retrieved {len(page_results['results'])} works from page {page_number}")
+            params['cursor'] = page_results['meta'].get('next_cursor')
         else:
+            # The next cursor is only known from a successful page, so stop here
             print(f"  Warning: Failed to fetch page {page_number} (status code: {response.status_code})")
-        
-        # Be gentle with the API - add a small delay between requests
-        time.sleep(0.1)
-    
+            break
+
+        if not email:
+            # Outside the polite pool, be gentle with the API - add a small delay between requests
+            time.sleep(0.1)
+
+    if len(all_results) < total_count:
+        # Do not overwrite the previous data with a truncated download
+        raise SystemExit(f"Error: Retrieved only {len(all_results)}/{total_count} works, data/polito_works.json left unchanged")
+
     # Write all results to file
     print(f"\nWriting {len(all_results)} total works to data/polito_works.json...")
-    with open('data/polito_works.json', 'w') as f: # Write the results to a file
-        json.dump(all_results, f, indent=2)   # Write the results to a file in the data folder
+    with open('data/polito_works.json', 'wb') as f: # Write the results to a file
+        f.write(orjson.dumps(all_results))   # Compact JSON: this file is only read by the build scripts, not meant for diffs
     print("Done!")
 else:
     print(f"Error: Failed to fetch data (status code: {response.status_code})")
+
+session.close()